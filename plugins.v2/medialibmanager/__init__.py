@@ -1,14 +1,58 @@
 # 文件名: __init__.py
+import json
 import os
-import re
+import sqlite3
+import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import openpyxl
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# httpx 与 h2 为可选依赖，安装后通过 HTTP/2 多路复用访问 TMDb，否则使用 requests
+try:
+    import h2  # noqa: F401
+    import httpx
+except ImportError:
+    httpx = None
+
+# python-calamine 为可选依赖，安装后使用其读取总表，速度远快于 openpyxl
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
 
 # 导入 MoviePilot 的核心模块
 from app.core.config import settings
 from app.log import logger
 
+from ._parse import get_movie_base_name, get_tv_show_base_name
+
+# TMDb 同时进行的请求数上限，以及每个请求完成后释放名额前的停顿（秒）；
+# 超出 TMDb 限流时由 _tmdb_get 按 429 / Retry-After 退避重试
+_TMDB_MAX_WORKERS = 20
+_TMDB_SLOT_PAUSE = 0.25
+# TMDb 限流及服务端错误时的重试次数、退避基数（秒）及需要重试的状态码
+_TMDB_MAX_RETRIES = 3
+_TMDB_BACKOFF = 0.3
+_TMDB_RETRY_STATUSES = frozenset({429, 502, 503, 504})
+# TMDb 详情缓存有效期（秒）
+_TMDB_CACHE_TTL = 30 * 24 * 3600
+# 删除文件的并发数，网络存储上单个删除请求主要耗时在往返延迟
+_DELETE_MAX_WORKERS = 16
+# 目录修改时间距扫描开始不足该时长（纳秒）时不记录，避免时间戳精度较粗的文件系统漏掉同一时刻新增的文件
+_MTIME_RACY_WINDOW_NS = 2 * 10**9
+# 写入 Parquet 时每个行组的行数
+_PARQUET_ROW_GROUP_SIZE = 50000
+
+# 视频文件扩展名
+_VIDEO_EXTS = frozenset({'.mkv', '.mp4', '.avi', '.ts', '.rmvb', '.mov'})
+
 class MediaLibraryManagerPlugin:
     """
     媒体库管家插件
@@ -25,17 +69,37 @@ class MediaLibraryManagerPlugin:
         self.tmdb_api_key = self.config.get('tmdb_api_key')
         self.use_proxy = self.config.get('use_proxy')
         self.proxy_url = self.config.get('proxy_url')
+        self.collect_sizes = self.config.get('collect_sizes', True)
+        # 运行期间配置不变，代理设置只计算一次
+        self._proxies = {"http": self.proxy_url, "https": self.proxy_url} if (self.use_proxy and self.proxy_url) else None
         
         # 定义插件使用的数据文件路径，存放在 MoviePilot 的 data 目录下
         self.data_path = os.path.join(settings.DATA_PATH, "plugins", "medialibmanager")
         os.makedirs(self.data_path, exist_ok=True) # 确保目录存在
         
-        self.movie_inventory_file = os.path.join(self.data_path, 'inventory_movies.xlsx')
-        self.tv_inventory_file = os.path.join(self.data_path, 'inventory_tv.xlsx')
-        self.enriched_movie_file = os.path.join(self.data_path, 'enriched_movies.xlsx')
-        self.enriched_tv_file = os.path.join(self.data_path, 'enriched_tv.xlsx')
+        self.movie_inventory_file = os.path.join(self.data_path, 'inventory_movies.parquet')
+        self.tv_inventory_file = os.path.join(self.data_path, 'inventory_tv.parquet')
+        self.enriched_movie_file = os.path.join(self.data_path, 'enriched_movies.parquet')
+        self.enriched_tv_file = os.path.join(self.data_path, 'enriched_tv.parquet')
         self.master_file = os.path.join(self.data_path, '_MASTER_inventory.xlsx')
         self.delete_list_file = os.path.join(self.data_path, 'files_to_delete.txt')
+        self.tmdb_cache_file = os.path.join(self.data_path, 'tmdb_cache.sqlite')
+        self.scan_manifest_file = os.path.join(self.data_path, 'scan_manifest.json')
+        
+        # TMDb 详情缓存，重新加载配置时先关闭旧连接
+        if getattr(self, '_tmdb_cache', None):
+            self._tmdb_cache.close()
+        self._tmdb_cache = sqlite3.connect(self.tmdb_cache_file, check_same_thread=False)
+        self._tmdb_cache.execute(
+            "CREATE TABLE IF NOT EXISTS tmdb(key TEXT PRIMARY KEY, fetched_at INTEGER, payload BLOB)")
+        self._tmdb_cache.commit()
+        
+        # TMDb 请求复用同一客户端的连接池，重新加载配置时先关闭旧客户端
+        if getattr(self, '_http', None):
+            self._http.close()
+        self._http = self._build_http_client()
+        # 同一插件实例的所有 TMDb 请求（包括同时触发的多次扫描）共享并发名额
+        self._tmdb_slots = threading.BoundedSemaphore(_TMDB_MAX_WORKERS)
         
         logger.info(f"{self.plugin_name}：插件已加载，数据目录位于 {self.data_path}")
 
@@ -95,70 +159,189 @@ class MediaLibraryManagerPlugin:
             logger.error(f"目录 '{base_dir}' 不存在。")
             return
 
-        inventory_data = []
-        video_extensions = ('.mkv', '.mp4', '.avi', '.ts', '.rmvb', '.mov')
+        # 按列收集清单数据，最后一次性构造 DataFrame
+        titles, years, paths, names, sizes, folders = [], [], [], [], [], []
         
-        for root, dirs, files in os.walk(base_dir):
-            for file_name in files:
-                if file_name.lower().endswith(video_extensions):
-                    folder_path = os.path.dirname(os.path.join(root, file_name))
-                    folder_name = os.path.basename(folder_path)
-                    
-                    if media_type == 'movie':
-                        base_title, year = self._get_movie_base_name(folder_name)
-                    else: # tv
-                        base_title, year = self._get_tv_show_base_name(folder_name)
-                        
-                    file_path = os.path.join(root, file_name)
-                    file_size_gb = round(os.path.getsize(file_path) / (1024**3), 2)
-                    
-                    inventory_data.append({
-                        'SearchTitle': base_title,
-                        'SearchYear': year,
-                        'FilePath': file_path,
-                        'FileName': file_name,
-                        'FileSizeGB': file_size_gb,
-                        'FolderPath': folder_path
-                    })
-
-        if not inventory_data:
+        # 同一文件夹下的文件（如同一季的各集）共享解析结果，每个文件夹名只解析一次
+        parse_name = get_movie_base_name if media_type == 'movie' else get_tv_show_base_name
+        parse_cache = {}
+
+        # 目录修改时间与上次扫描一致时，直接沿用上次清单中该目录下的文件，无需逐个 stat。
+        # 文件被原地覆盖时目录修改时间不变，沿用的 FileSizeGB 可能过期，直到该目录有文件增删为止
+        output_file = self.movie_inventory_file if media_type == 'movie' else self.tv_inventory_file
+        manifest = self._load_scan_manifest()
+        old_mtimes = manifest.get(media_type, {})
+        new_mtimes = {}
+        racy_after = time.time_ns() - _MTIME_RACY_WINDOW_NS
+        cached_files = self._load_cached_files(output_file) if old_mtimes else {}
+        if cached_files is None:
+            # 上次的清单无法沿用，执行完整扫描
+            old_mtimes, cached_files = {}, {}
+
+        for file_path, file_name, file_size, folder_path in self._iter_videos(
+                base_dir, old_mtimes, new_mtimes, cached_files, racy_after):
+            folder_name = os.path.basename(folder_path)
+            parsed = parse_cache.get(folder_name)
+            if parsed is None:
+                parsed = parse_cache[folder_name] = parse_name(folder_name)
+            base_title, year = parsed
+
+            titles.append(base_title)
+            years.append(year)
+            paths.append(file_path)
+            names.append(file_name)
+            if self.collect_sizes:
+                sizes.append(file_size)
+            folders.append(folder_path)
+
+        if not paths:
             logger.warning(f"{media_type} 目录扫描完成，但未找到视频文件。")
+            # 清除扫描记录，避免下次扫描沿用与清单不一致的目录修改时间
+            if manifest.pop(media_type, None) is not None:
+                self._save_scan_manifest(manifest)
             return
 
-        df = pd.DataFrame(inventory_data)
-        output_file = self.movie_inventory_file if media_type == 'movie' else self.tv_inventory_file
-        df.to_excel(output_file, index=False)
+        string_dtype = 'string[pyarrow]'
+        columns = {
+            'SearchTitle': pd.array(titles, dtype=string_dtype),
+            'SearchYear': pd.array(years, dtype=string_dtype),
+            'FilePath': pd.array(paths, dtype=string_dtype),
+            'FileName': pd.array(names, dtype=string_dtype)
+        }
+        if self.collect_sizes:
+            columns['FileSizeGB'] = sizes
+        columns['FolderPath'] = pd.array(folders, dtype=string_dtype)
+        df = pd.DataFrame(columns)
+        df.to_parquet(output_file, engine="pyarrow", compression="zstd", index=False)
         logger.info(f"{media_type} 清单已生成：{output_file}")
 
+        manifest[media_type] = new_mtimes
+        self._save_scan_manifest(manifest)
+
+    def _iter_videos(self, folder_path, old_mtimes, new_mtimes, cached_files, racy_after):
+        # 基于 os.scandir 递归遍历，目录项自带类型信息，文件大小最多只需一次 stat
+        try:
+            mtime = os.stat(folder_path).st_mtime_ns
+            with os.scandir(folder_path) as it:
+                entries = list(it)
+        except OSError as e:
+            logger.warning(f"无法读取目录 '{folder_path}': {e}")
+            return
+        if mtime < racy_after:
+            # 修改时间过于接近本次扫描的目录不记录，下次扫描时重新读取
+            new_mtimes[folder_path] = mtime
+
+        # 目录中文件的增删都会改变目录的修改时间，未变化时沿用上次的结果
+        unchanged = old_mtimes.get(folder_path) == mtime
+        if unchanged:
+            for file_path, file_name, file_size in cached_files.get(folder_path, ()):
+                yield file_path, file_name, file_size, folder_path
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from self._iter_videos(entry.path, old_mtimes, new_mtimes, cached_files, racy_after)
+            elif not unchanged and os.path.splitext(entry.name)[1].lower() in _VIDEO_EXTS:
+                # 未开启文件大小统计时不调用 stat，文件大小返回 None
+                file_size = None
+                if self.collect_sizes:
+                    try:
+                        file_size = round(entry.stat().st_size / (1024**3), 2)
+                    except OSError as e:
+                        logger.warning(f"无法读取文件信息 '{entry.path}': {e}")
+                        # 不记录该目录的修改时间，下次扫描时重新读取
+                        new_mtimes.pop(folder_path, None)
+                        continue
+                yield entry.path, entry.name, file_size, folder_path
+
+    def _load_cached_files(self, inventory_file):
+        # 读取上次的清单，按所在目录分组为 {FolderPath: [(FilePath, FileName, FileSizeGB), ...]}；
+        # 清单不存在、无法读取或缺少所需的文件大小列时返回 None
+        if not os.path.exists(inventory_file):
+            return None
+        try:
+            df = pd.read_parquet(inventory_file, engine="pyarrow")
+        except Exception as e:
+            logger.warning(f"上次的清单读取失败，将执行完整扫描: {e}")
+            return None
+        if self.collect_sizes and 'FileSizeGB' not in df.columns:
+            # 上次扫描未统计文件大小，无法沿用
+            return None
+        sizes = df['FileSizeGB'] if 'FileSizeGB' in df.columns else [None] * len(df)
+        cached_files = {}
+        for folder_path, file_path, file_name, file_size in zip(df['FolderPath'], df['FilePath'], df['FileName'], sizes):
+            cached_files.setdefault(folder_path, []).append((file_path, file_name, file_size))
+        return cached_files
+
+    def _load_scan_manifest(self):
+        if not os.path.exists(self.scan_manifest_file):
+            return {}
+        try:
+            with open(self.scan_manifest_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"扫描记录文件读取失败，将执行完整扫描: {e}")
+            return {}
+
+    def _save_scan_manifest(self, manifest):
+        with open(self.scan_manifest_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+
     def _enrich_inventory(self, inventory_path, media_type):
         logger.info(f"开始为 {media_type} 清单丰富TMDb信息...")
-        df = pd.read_excel(inventory_path)
-        enriched_data = []
+        df = pd.read_parquet(inventory_path)
         
         unique_items = df.drop_duplicates(subset=['SearchTitle', 'SearchYear'])
         logger.info(f"共找到 {len(unique_items)} 部独立的 {media_type} 需要获取信息...")
 
         item_details_cache = {}
-        for index, row in unique_items.iterrows():
-            logger.info(f"处理中 ({index + 1}/{len(unique_items)}): {row['SearchTitle']}")
-            details = self._get_tmdb_details(row['SearchTitle'], row['SearchYear'], media_type)
-            item_details_cache[(row['SearchTitle'], row['SearchYear'])] = details
-            time.sleep(0.1)
+        pending = []
+        for row in unique_items[['SearchTitle', 'SearchYear']].itertuples(index=False):
+            key = (row.SearchTitle, row.SearchYear)
+            details = self._get_cached_tmdb_details(key[0], key[1], media_type)
+            if details is None:
+                pending.append(key)
+            else:
+                item_details_cache[key] = details
+        logger.info(f"其中 {len(item_details_cache)} 部命中本地缓存，{len(pending)} 部需要请求TMDb...")
+
+        total = len(pending)
+        with ThreadPoolExecutor(max_workers=_TMDB_MAX_WORKERS) as pool:
+            futures = {pool.submit(self._fetch_tmdb_details, key[0], key[1], media_type): key for key in pending}
+            for done, future in enumerate(as_completed(futures), start=1):
+                key = futures[future]
+                details = future.result()
+                item_details_cache[key] = details
+                if details:
+                    self._put_cached_tmdb_details(key[0], key[1], media_type, details)
+                if done % 100 == 0:
+                    self._tmdb_cache.commit()
+                logger.info(f"处理中 ({done}/{total}): {key[0]}")
+        self._tmdb_cache.commit()
 
         logger.info("信息获取完成，正在匹配到所有文件行...")
-        for index, row in df.iterrows():
-            details = item_details_cache.get((row['SearchTitle'], row['SearchYear']), {})
-            new_data = row.to_dict()
-            if details:
-                if media_type == 'movie':
-                    new_data.update(self._parse_movie_details(details))
-                else: # tv
-                    new_data.update(self._parse_tv_details(details))
-            enriched_data.append(new_data)
-        
-        enriched_df = pd.DataFrame(enriched_data)
+        parse_details = self._parse_movie_details if media_type == 'movie' else self._parse_tv_details
+        details_records = [{'SearchTitle': title, 'SearchYear': year, **parse_details(details)}
+                           for (title, year), details in item_details_cache.items() if details]
+        if details_records:
+            details_df = pd.DataFrame.from_records(details_records)
+        else:
+            details_df = pd.DataFrame(columns=['SearchTitle', 'SearchYear'])
+        # 连接键与清单保持相同类型，确保合并时能正确匹配
+        details_df = details_df.astype({'SearchTitle': df['SearchTitle'].dtype, 'SearchYear': df['SearchYear'].dtype})
+        # 按固定行数分块合并并写入，内存中只保留当前分块的合并结果。
+        # 输出的 schema 由清单与完整的 details_df 预先确定，避免各分块自行推断出不同的列类型
+        detail_fields = [f for f in pa.Schema.from_pandas(details_df, preserve_index=False)
+                         if f.name not in ('SearchTitle', 'SearchYear')]
+        schema = pa.schema(list(pa.Schema.from_pandas(df, preserve_index=False)) + detail_fields)
         output_file = self.enriched_movie_file if media_type == 'movie' else self.enriched_tv_file
-        enriched_df.to_excel(output_file, index=False)
+        writer = pq.ParquetWriter(output_file, schema, compression='zstd')
+        try:
+            for offset in range(0, len(df), _PARQUET_ROW_GROUP_SIZE):
+                chunk = df.iloc[offset:offset + _PARQUET_ROW_GROUP_SIZE].merge(
+                    details_df, on=['SearchTitle', 'SearchYear'], how='left')
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        finally:
+            writer.close()
         logger.info(f"丰富的 {media_type} 清单已生成：{output_file}")
 
     def _combine_inventories(self):
@@ -172,36 +355,35 @@ class MediaLibraryManagerPlugin:
 
         df_movies = pd.DataFrame()
         if has_movies:
-            df_movies = pd.read_excel(self.enriched_movie_file)
+            df_movies = pd.read_parquet(self.enriched_movie_file)
             df_movies['Type'] = 'Movie'
             df_movies.rename(columns={'TMDb_Title': 'TMDb_Name', 'ReleaseDate': 'AirDate', 'Runtime_Minutes': 'Runtime'}, inplace=True)
 
         df_tv = pd.DataFrame()
         if has_tv:
-            df_tv = pd.read_excel(self.enriched_tv_file)
+            df_tv = pd.read_parquet(self.enriched_tv_file)
             df_tv['Type'] = 'TV Show'
             df_tv.rename(columns={'FirstAirDate': 'AirDate'}, inplace=True)
             
         df_combined = pd.concat([df_movies, df_tv], ignore_index=True)
-        df_combined.to_excel(self.master_file, index=False)
+        self._fast_to_xlsx(df_combined, self.master_file)
         logger.info(f"合并成功！总清单已生成：{self.master_file}")
 
     def _create_deletion_list(self):
         logger.info("正在根据总表生成待删除文件列表...")
-        df = pd.read_excel(self.master_file)
-        if 'Action' not in df.columns:
-            logger.error("总表中缺少 'Action' 列。请添加此列并标记要删除的文件。")
+        try:
+            files_to_delete = [str(path) for action, path in self._iter_master_action_rows()
+                               if str(action).upper() == 'DELETE' and path not in (None, '')]
+        except KeyError as e:
+            logger.error(f"总表中缺少 '{e.args[0]}' 列。请添加此列并标记要删除的文件。")
             return
             
-        delete_df = df[df['Action'].astype(str).str.upper() == 'DELETE']
-        if delete_df.empty:
+        if not files_to_delete:
             logger.info("在 'Action' 列中没有找到任何标记为 'DELETE' 的项。")
             return
             
-        files_to_delete = delete_df['FilePath'].tolist()
         with open(self.delete_list_file, 'w', encoding='utf-8') as f:
-            for path in files_to_delete:
-                f.write(path + "\n")
+            f.write("\n".join(files_to_delete) + "\n")
         logger.info(f"找到 {len(files_to_delete)} 个待删除文件，列表已生成：{self.delete_list_file}")
 
     def _execute_deletion(self):
@@ -217,17 +399,21 @@ class MediaLibraryManagerPlugin:
             logger.info("待删除列表为空，无需任何操作。")
             return "待删除列表为空，无需任何操作。"
             
-        deleted_count = 0
-        for f_path in files_to_delete:
-            try:
-                if os.path.exists(f_path) and os.path.isfile(f_path):
-                    os.remove(f_path)
-                    logger.info(f"[已删除] {f_path}")
-                    deleted_count += 1
-                else:
-                    logger.warning(f"[跳过] 文件已不存在: {f_path}")
-            except Exception as e:
-                logger.error(f"[删除失败] {f_path} -> 错误: {e}")
+        # 成功删除的文件逐条记录到当天的删除历史文件中，日志中只输出汇总
+        history_file = os.path.join(self.data_path, f"deletion_history_{time.strftime('%Y%m%d')}.log")
+        deleted_files = []
+        with ThreadPoolExecutor(max_workers=_DELETE_MAX_WORKERS) as pool, \
+                open(history_file, 'a', encoding='utf-8') as history_fh:
+            # 去重后再分发，避免同一路径被两个线程同时删除
+            futures = {pool.submit(self._try_remove, f_path): f_path for f_path in dict.fromkeys(files_to_delete)}
+            for future in as_completed(futures):
+                if future.result():
+                    f_path = futures[future]
+                    history_fh.write(f"{f_path}\n")
+                    deleted_files.append(f_path)
+        deleted_count = len(deleted_files)
+        if deleted_files:
+            logger.info(f"[已删除 {deleted_count} 个文件] 示例: {deleted_files[:5]}，完整列表见 {history_file}")
                 
         # 清理工作
         os.remove(self.delete_list_file)
@@ -236,34 +422,140 @@ class MediaLibraryManagerPlugin:
         logger.info(result_message)
         return result_message
 
+    # -- 文件读写辅助方法 --
+
+    @staticmethod
+    def _try_remove(f_path):
+        # 在线程池中执行，返回是否成功删除；成功的删除由调用方汇总记录
+        try:
+            if os.path.exists(f_path) and os.path.isfile(f_path):
+                os.remove(f_path)
+                return True
+            logger.warning(f"[跳过] 文件已不存在: {f_path}")
+        except Exception as e:
+            logger.error(f"[删除失败] {f_path} -> 错误: {e}")
+        return False
+
+    @staticmethod
+    def _fast_to_xlsx(df, path):
+        # 使用 openpyxl 只写模式逐行写入，避免 to_excel 为每个单元格创建样式对象
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(list(df.columns))
+        # 空值写为空单元格，与 to_excel 的行为一致
+        values = df.astype(object).where(df.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            ws.append(row)
+        wb.save(path)
+
+    def _iter_master_action_rows(self):
+        # 流式读取总表，只取出 Action 与 FilePath 两列；缺少任一列时抛出 KeyError
+        if CalamineWorkbook:
+            with CalamineWorkbook.from_path(self.master_file) as wb:
+                yield from self._select_action_columns(wb.get_sheet_by_index(0).iter_rows())
+            return
+
+        wb = openpyxl.load_workbook(self.master_file, read_only=True, data_only=True)
+        try:
+            yield from self._select_action_columns(wb.worksheets[0].iter_rows(values_only=True))
+        finally:
+            wb.close()
+
+    @staticmethod
+    def _select_action_columns(rows):
+        header = list(next(rows, ()))
+        missing = [c for c in ('Action', 'FilePath') if c not in header]
+        if missing:
+            raise KeyError(missing[0])
+        action_idx, path_idx = header.index('Action'), header.index('FilePath')
+        for row in rows:
+            if len(row) > max(action_idx, path_idx):
+                yield row[action_idx], row[path_idx]
+
     # -- TMDb API & 解析辅助方法 --
     
-    def _get_proxies(self):
-        if self.use_proxy and self.proxy_url:
-            return {"http": self.proxy_url, "https": self.proxy_url}
-        return None
+    def _build_http_client(self):
+        headers = {"accept": "application/json", "Authorization": f"Bearer {self.tmdb_api_key}"}
+        if httpx:
+            # HTTP/2 下各工作线程的请求复用同一连接。不传入自定义 transport，这样在插件中未配置代理时，
+            # httpx 会与 requests 一样使用 HTTP(S)_PROXY 等环境变量中的代理。限流重试见 _tmdb_get
+            return httpx.Client(
+                http2=True,
+                headers=headers,
+                proxy=self.proxy_url if self._proxies else None,
+                trust_env=True,
+                limits=httpx.Limits(max_connections=_TMDB_MAX_WORKERS),
+                timeout=10.0
+            )
+        # 连接池大小与并发数保持一致，连接层失败时自动重试；按状态码的重试只在 _tmdb_get 中进行，
+        # 因此关闭 urllib3 对 Retry-After 的处理，避免 429/503 被重复重试
+        session = requests.Session()
+        session.headers.update(headers)
+        session.proxies = self._proxies or {}
+        adapter = HTTPAdapter(
+            pool_connections=_TMDB_MAX_WORKERS,
+            pool_maxsize=_TMDB_MAX_WORKERS,
+            max_retries=Retry(total=_TMDB_MAX_RETRIES, backoff_factor=_TMDB_BACKOFF,
+                              respect_retry_after_header=False)
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @staticmethod
+    def _tmdb_cache_key(title, year, media_type):
+        return f"{media_type}|{title}|{year if pd.notna(year) else ''}"
+
+    def _get_cached_tmdb_details(self, title, year, media_type):
+        row = self._tmdb_cache.execute(
+            "SELECT payload FROM tmdb WHERE key=? AND fetched_at>?",
+            (self._tmdb_cache_key(title, year, media_type), int(time.time()) - _TMDB_CACHE_TTL)
+        ).fetchone()
+        if not row:
+            return None
+        return json.loads(zlib.decompress(row[0]))
+
+    def _put_cached_tmdb_details(self, title, year, media_type, details):
+        # 只缓存成功获取的详情，请求失败或未找到的条目下次扫描时重新请求
+        self._tmdb_cache.execute(
+            "INSERT OR REPLACE INTO tmdb(key, fetched_at, payload) VALUES (?, ?, ?)",
+            (self._tmdb_cache_key(title, year, media_type), int(time.time()),
+             zlib.compress(json.dumps(details, ensure_ascii=False).encode('utf-8'), 1))
+        )
+
+    def _fetch_tmdb_details(self, title, year, media_type):
+        # 在线程池中执行，同时进行的请求数由 _tmdb_get 中共享的并发名额控制
+        return self._get_tmdb_details(title, year if pd.notna(year) else None, media_type)
+
+    def _tmdb_get(self, url, params):
+        # 限流（429）及网关错误时按 Retry-After 或指数退避重试，对 requests 与 httpx 客户端一致生效
+        for attempt in range(_TMDB_MAX_RETRIES + 1):
+            with self._tmdb_slots:
+                response = self._http.get(url, params=params, timeout=10)
+                time.sleep(_TMDB_SLOT_PAUSE)
+            if response.status_code not in _TMDB_RETRY_STATUSES or attempt == _TMDB_MAX_RETRIES:
+                response.raise_for_status()
+                return response.json()
+            retry_after = response.headers.get('Retry-After', '')
+            time.sleep(float(retry_after) if retry_after.isdigit() else _TMDB_BACKOFF * 2 ** attempt)
 
     def _get_tmdb_details(self, title, year, media_type):
         api_path = 'tv' if media_type == 'tv' else 'movie'
-        headers = {"accept": "application/json", "Authorization": f"Bearer {self.tmdb_api_key}"}
         
-        search_url = f"https://api.themoviedb.org/3/search/{api_path}?query={requests.utils.quote(title)}&language=zh-CN"
+        search_url = f"https://api.themoviedb.org/3/search/{api_path}"
+        params = {'query': title, 'language': 'zh-CN'}
         if year:
             year_param = 'first_air_date_year' if media_type == 'tv' else 'year'
-            search_url += f"&{year_param}={year}"
+            params[year_param] = year
             
         try:
-            response = requests.get(search_url, headers=headers, proxies=self._get_proxies())
-            response.raise_for_status()
-            results = response.json().get('results', [])
+            results = self._tmdb_get(search_url, params).get('results', [])
             if not results:
                 return {}
             
             item_id = results[0]['id']
-            details_url = f"https://api.themoviedb.org/3/{api_path}/{item_id}?language=zh-CN"
-            response = requests.get(details_url, headers=headers, proxies=self._get_proxies())
-            response.raise_for_status()
-            return response.json()
+            details_url = f"https://api.themoviedb.org/3/{api_path}/{item_id}"
+            return self._tmdb_get(details_url, {'language': 'zh-CN'})
         except Exception as e:
             logger.error(f"请求TMDb API时出错 (Title: {title}): {e}")
             return {}
@@ -290,17 +582,3 @@ class MediaLibraryManagerPlugin:
             'EpisodesCount': details.get('number_of_episodes', 0),
             'Overview': details.get('overview', 'N/A')
         }
-        
-    def _get_movie_base_name(self, text):
-        match = re.match(r'^(.*?)\s*\((\d{4})\)', text)
-        if match:
-            return match.group(1).strip().replace('.', ' ').strip(), match.group(2)
-        return text.strip().replace('.', ' ').strip(), None
-
-    def _get_tv_show_base_name(self, text):
-        match = re.match(r'^(.*?)\s*\((\d{4})\)', text)
-        if match:
-            return match.group(1).strip().replace('.', ' ').strip(), match.group(2)
-        cleaned_title = re.sub(r'[\s\.]S\d{1,2}(E\d{1,2})?.*', '', text, flags=re.IGNORECASE).strip()
-        cleaned_title = re.sub(r'[\s\.]Season[\s\.]\d{1,2}.*', '', cleaned_title, flags=re.IGNORECASE).strip()
-        return cleaned_title.replace('.', ' ').strip(), None
\ No newline at end of file
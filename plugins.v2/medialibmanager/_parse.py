@@ -0,0 +1,23 @@
+# 文件名: _parse.py
+# 文件夹名称解析函数。本模块只依赖标准库且带完整类型注解，
+# 可直接用 mypyc 编译为扩展模块；编译产物存在时会优先于本文件被导入。
+import re
+from typing import Optional, Tuple
+
+_MOVIE_RE = re.compile(r'^(.*?)\s*\((\d{4})\)')
+_TV_CLEAN_RE = re.compile(r'[\s\.](?:S\d{1,2}(?:E\d{1,2})?|Season[\s\.]\d{1,2}).*', re.IGNORECASE)
+
+
+def get_movie_base_name(text: str) -> Tuple[str, Optional[str]]:
+    match = _MOVIE_RE.match(text)
+    if match:
+        return match.group(1).strip().replace('.', ' ').strip(), match.group(2)
+    return text.strip().replace('.', ' ').strip(), None
+
+
+def get_tv_show_base_name(text: str) -> Tuple[str, Optional[str]]:
+    match = _MOVIE_RE.match(text)
+    if match:
+        return match.group(1).strip().replace('.', ' ').strip(), match.group(2)
+    cleaned_title = _TV_CLEAN_RE.sub('', text).strip()
+    return cleaned_title.replace('.', ' ').strip(), None
@@ -0,0 +1,465 @@
+import importlib.util
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import types
+
+import pandas as pd
+import pytest
+
+PLUGIN_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "plugins.v2", "medialibmanager")
+
+
+@pytest.fixture
+def plugin_module(tmp_path, monkeypatch):
+    # 用最小的 app 模块替代 MoviePilot 运行环境
+    settings = types.SimpleNamespace(DATA_PATH=str(tmp_path / "data"))
+    app = types.ModuleType("app")
+    app_core = types.ModuleType("app.core")
+    app_config = types.ModuleType("app.core.config")
+    app_config.settings = settings
+    app_log = types.ModuleType("app.log")
+    app_log.logger = logging.getLogger("medialibmanager-test")
+    for name, module in {"app": app, "app.core": app_core, "app.core.config": app_config,
+                         "app.log": app_log}.items():
+        monkeypatch.setitem(sys.modules, name, module)
+
+    spec = importlib.util.spec_from_file_location(
+        "medialibmanager", os.path.join(PLUGIN_DIR, "__init__.py"),
+        submodule_search_locations=[PLUGIN_DIR])
+    module = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, "medialibmanager", module)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def plugin(plugin_module):
+    instance = plugin_module.MediaLibraryManagerPlugin()
+    yield instance
+    instance._tmdb_cache.close()
+    instance._http.close()
+
+
+@pytest.fixture
+def tv_library(tmp_path):
+    files = [
+        tmp_path / "tv" / "Show A" / "Show.A.S01" / "Show.A.S01E01.mkv",
+        tmp_path / "tv" / "Show A" / "Show.A.S01" / "Show.A.S01E02.mkv",
+        tmp_path / "tv" / "Show B (2020)" / "Show.B.S01E01.mp4",
+    ]
+    for f in files:
+        f.parent.mkdir(parents=True, exist_ok=True)
+        f.write_bytes(b"\0" * 1024)
+    # 目录修改时间设为一小时前，使其不落在扫描的时间戳精度保护窗口内
+    an_hour_ago = time.time() - 3600
+    for root, dirs, _ in os.walk(tmp_path / "tv"):
+        os.utime(root, (an_hour_ago, an_hour_ago))
+    return str(tmp_path / "tv"), sorted(str(f) for f in files)
+
+
+def _scan(plugin, base_dir, collect_sizes=True):
+    plugin.init_plugin({"tv_path": base_dir, "tmdb_api_key": "x", "collect_sizes": collect_sizes})
+    plugin._generate_inventory(base_dir, 'tv')
+    return pd.read_parquet(plugin.tv_inventory_file)
+
+
+def test_rescan_reuses_unchanged_directories(plugin, tv_library):
+    base_dir, files = tv_library
+    first = _scan(plugin, base_dir)
+    second = _scan(plugin, base_dir)
+    assert sorted(second['FilePath']) == files
+    assert second.sort_values('FilePath').reset_index(drop=True).equals(
+        first.sort_values('FilePath').reset_index(drop=True))
+
+
+def test_enabling_sizes_after_sizeless_scan_rescans_all_files(plugin, tv_library):
+    base_dir, files = tv_library
+    assert 'FileSizeGB' not in _scan(plugin, base_dir, collect_sizes=False).columns
+
+    df = _scan(plugin, base_dir, collect_sizes=True)
+    assert sorted(df['FilePath']) == files
+    assert df['FileSizeGB'].notna().all()
+
+
+def test_missing_inventory_with_manifest_rescans_all_files(plugin, tv_library):
+    base_dir, files = tv_library
+    _scan(plugin, base_dir)
+    os.remove(plugin.tv_inventory_file)
+
+    df = _scan(plugin, base_dir)
+    assert sorted(df['FilePath']) == files
+
+
+def test_rescan_takes_rows_from_previous_inventory(plugin, tv_library):
+    base_dir, files = tv_library
+    _scan(plugin, base_dir)
+    # 篡改上次清单中的文件大小，若目录被沿用则新清单保留该值
+    df = pd.read_parquet(plugin.tv_inventory_file)
+    df['FileSizeGB'] = 42.0
+    df.to_parquet(plugin.tv_inventory_file, index=False)
+
+    assert (_scan(plugin, base_dir)['FileSizeGB'] == 42.0).all()
+
+
+def test_recently_modified_directory_is_rescanned(plugin, tv_library):
+    base_dir, files = tv_library
+    show_b = os.path.join(base_dir, "Show B (2020)")
+    os.utime(show_b)
+    mtime = os.stat(show_b).st_mtime_ns
+    _scan(plugin, base_dir)
+    with open(plugin.scan_manifest_file, encoding='utf-8') as f:
+        recorded = json.load(f)['tv']
+    assert show_b not in recorded
+    assert os.path.join(base_dir, "Show A") in recorded
+
+    # 模拟时间戳精度较粗的文件系统：新增文件后目录修改时间不变
+    new_file = os.path.join(show_b, "Show.B.S01E02.mp4")
+    with open(new_file, 'wb') as f:
+        f.write(b"\0")
+    os.utime(show_b, ns=(mtime, mtime))
+
+    assert sorted(_scan(plugin, base_dir)['FilePath']) == sorted(files + [new_file])
+
+
+class _FakeResponse:
+    def __init__(self, status_code, payload=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._payload = payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return self._payload
+
+
+class _FakeClient:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        return self.responses.pop(0)
+
+    def close(self):
+        pass
+
+
+def test_tmdb_get_retries_rate_limited_responses(plugin_module, plugin, monkeypatch):
+    plugin.init_plugin({"tmdb_api_key": "x"})
+    sleeps = []
+    monkeypatch.setattr(plugin_module.time, "sleep", sleeps.append)
+    monkeypatch.setattr(plugin_module, "_TMDB_SLOT_PAUSE", 0)
+    plugin._http = _FakeClient([
+        _FakeResponse(429, headers={'Retry-After': '2'}),
+        _FakeResponse(503),
+        _FakeResponse(200, {'results': []}),
+    ])
+
+    assert plugin._tmdb_get("https://api.themoviedb.org/3/search/tv", {}) == {'results': []}
+    assert plugin._http.calls == 3
+    assert [d for d in sleeps if d] == [2.0, 0.6]
+
+
+def test_tmdb_get_gives_up_after_max_retries(plugin_module, plugin, monkeypatch):
+    plugin.init_plugin({"tmdb_api_key": "x"})
+    monkeypatch.setattr(plugin_module.time, "sleep", lambda _: None)
+    plugin._http = _FakeClient([_FakeResponse(429)] * 4)
+
+    with pytest.raises(RuntimeError):
+        plugin._tmdb_get("https://api.themoviedb.org/3/search/tv", {})
+    assert plugin._http.calls == 4
+
+
+def test_requests_session_leaves_status_retries_to_tmdb_get(plugin_module, plugin, monkeypatch):
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    requests_seen = []
+
+    class AlwaysRateLimited(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    for var in ('HTTP_PROXY', 'HTTPS_PROXY', 'ALL_PROXY', 'http_proxy', 'https_proxy', 'all_proxy'):
+        monkeypatch.delenv(var, raising=False)
+    monkeypatch.setattr(plugin_module, "httpx", None)
+    monkeypatch.setattr(plugin_module, "_TMDB_SLOT_PAUSE", 0)
+    plugin.init_plugin({"tmdb_api_key": "x"})
+
+    server = HTTPServer(('127.0.0.1', 0), AlwaysRateLimited)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with pytest.raises(Exception):
+            plugin._tmdb_get(f"http://127.0.0.1:{server.server_port}/3/search/tv", {})
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert len(requests_seen) == plugin_module._TMDB_MAX_RETRIES + 1
+
+
+@pytest.mark.parametrize("client", ["requests", "httpx"])
+def test_http_client_honours_environment_proxy(plugin_module, plugin, monkeypatch, client):
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    if client == "httpx" and plugin_module.httpx is None:
+        pytest.skip("httpx/h2 未安装")
+    if client == "requests":
+        monkeypatch.setattr(plugin_module, "httpx", None)
+
+    proxied = []
+
+    class Proxy(BaseHTTPRequestHandler):
+        def do_GET(self):
+            # 经代理转发的请求行中带有完整的目标地址
+            proxied.append(self.path)
+            body = b'{"results": []}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Proxy)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    for var in ('NO_PROXY', 'no_proxy', 'ALL_PROXY', 'all_proxy', 'http_proxy'):
+        monkeypatch.delenv(var, raising=False)
+    monkeypatch.setenv('HTTP_PROXY', f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(plugin_module, "_TMDB_SLOT_PAUSE", 0)
+    try:
+        plugin.init_plugin({"tmdb_api_key": "x"})
+        assert plugin._tmdb_get("http://api.themoviedb.org/3/search/tv", {'query': 'x'}) == {'results': []}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert proxied and proxied[0].startswith("http://api.themoviedb.org/3/search/tv")
+
+
+class _SlowTmdbClient:
+    """
+    模拟固定延迟的 TMDb，记录同时进行的请求数
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def get(self, url, params=None, timeout=None):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.latency)
+        with self.lock:
+            self.in_flight -= 1
+        if '/search/' in url:
+            return _FakeResponse(200, {'results': [{'id': 1}]})
+        return _FakeResponse(200, {'name': 'TMDb 剧集'})
+
+    def close(self):
+        pass
+
+
+def test_tmdb_fetches_run_concurrently_within_slot_limit(plugin_module, plugin, monkeypatch):
+    plugin.init_plugin({"tmdb_api_key": "x"})
+    monkeypatch.setattr(plugin_module, "_TMDB_MAX_WORKERS", 4)
+    monkeypatch.setattr(plugin_module, "_TMDB_SLOT_PAUSE", 0.05)
+    plugin._tmdb_slots = threading.BoundedSemaphore(4)
+    plugin._http = _SlowTmdbClient(latency=0.05)
+    titles = [f"Title {i}" for i in range(20)]
+    pd.DataFrame({'SearchTitle': titles, 'SearchYear': [None] * 20, 'FilePath': titles}).to_parquet(
+        plugin.tv_inventory_file, index=False)
+
+    started = time.monotonic()
+    plugin._enrich_inventory(plugin.tv_inventory_file, 'tv')
+    elapsed = time.monotonic() - started
+
+    # 顺序执行需要 20 × 2 × (0.05 + 0.05) = 4 秒；4 个并发名额约 1 秒
+    assert 1 < plugin._http.max_in_flight <= 4
+    assert elapsed < 2
+    assert pd.read_parquet(plugin.enriched_tv_file)['TMDb_Name'].notna().all()
+
+
+@pytest.mark.parametrize("use_calamine", [True, False])
+def test_deletion_list_contains_only_marked_files(plugin_module, plugin, monkeypatch, use_calamine):
+    if use_calamine:
+        pytest.importorskip("python_calamine")
+    else:
+        monkeypatch.setattr(plugin_module, "CalamineWorkbook", None)
+    plugin.init_plugin({"tmdb_api_key": "x"})
+    df = pd.DataFrame({
+        'FilePath': ['/media/a.mkv', '/media/b.mkv', None, '/media/d.mkv'],
+        'Overview': ['x', 'y', 'z', 'w'],
+        'Action': ['DELETE', None, 'DELETE', 'delete'],
+    })
+    plugin._fast_to_xlsx(df, plugin.master_file)
+
+    plugin._create_deletion_list()
+    with open(plugin.delete_list_file, encoding='utf-8') as f:
+        assert f.read().splitlines() == ['/media/a.mkv', '/media/d.mkv']
+
+
+def test_duplicate_paths_are_deleted_once(plugin, tmp_path, monkeypatch):
+    plugin.init_plugin({"tmdb_api_key": "x"})
+    target = tmp_path / "dup.mkv"
+    target.write_bytes(b"\0")
+    with open(plugin.delete_list_file, 'w', encoding='utf-8') as f:
+        f.write(f"{target}\n{target}\n{target}\n")
+    attempts = []
+    real_try_remove = plugin._try_remove
+    monkeypatch.setattr(plugin, "_try_remove", lambda p: attempts.append(p) or real_try_remove(p))
+
+    assert plugin._execute_deletion() == "操作完成！共成功删除 1 个文件。"
+    assert attempts == [str(target)]
+    assert not target.exists()
+
+
+def test_enrichment_is_written_in_row_groups_with_one_schema(plugin_module, plugin, tv_library, monkeypatch):
+    import pyarrow.parquet as pq
+
+    base_dir, files = tv_library
+    _scan(plugin, base_dir)
+    monkeypatch.setattr(plugin_module, "_PARQUET_ROW_GROUP_SIZE", 1)
+    details = {'Show A': {'name': '剧集A', 'vote_average': 8.1, 'number_of_seasons': 2,
+                          'number_of_episodes': 20, 'genres': [{'name': '剧情'}]}}
+    monkeypatch.setattr(plugin, "_fetch_tmdb_details", lambda title, year, media_type: details.get(title, {}))
+
+    plugin._enrich_inventory(plugin.tv_inventory_file, 'tv')
+
+    meta = pq.ParquetFile(plugin.enriched_tv_file).metadata
+    assert meta.num_row_groups == len(files)
+    df = pd.read_parquet(plugin.enriched_tv_file).set_index('FilePath').sort_index()
+    assert list(df['TMDb_Name'].fillna('')) == ['剧集A', '剧集A', '']
+    assert list(df['SeasonsCount'].fillna(-1)) == [2, 2, -1]
+
+    plugin._combine_inventories()
+    assert os.path.exists(plugin.master_file)
+
+
+def _enrich_titles(plugin, monkeypatch, titles, details_for):
+    pd.DataFrame({'SearchTitle': titles, 'SearchYear': [None] * len(titles), 'FilePath': titles}).to_parquet(
+        plugin.tv_inventory_file, index=False)
+    monkeypatch.setattr(plugin, "_fetch_tmdb_details", lambda title, year, media_type: details_for(title))
+    plugin._enrich_inventory(plugin.tv_inventory_file, 'tv')
+
+
+def test_tmdb_cache_round_trip_with_missing_year(plugin):
+    plugin.init_plugin({"tmdb_api_key": "x"})
+    details = {'name': '剧集', 'genres': [{'name': '剧情'}]}
+
+    assert plugin._tmdb_cache_key('Show', pd.NA, 'tv') == plugin._tmdb_cache_key('Show', None, 'tv') == 'tv|Show|'
+    assert plugin._get_cached_tmdb_details('Show', pd.NA, 'tv') is None
+    plugin._put_cached_tmdb_details('Show', pd.NA, 'tv', details)
+    assert plugin._get_cached_tmdb_details('Show', None, 'tv') == details
+    assert plugin._get_cached_tmdb_details('Show', '2020', 'tv') is None
+    assert plugin._get_cached_tmdb_details('Show', None, 'movie') is None
+
+
+def test_tmdb_cache_entries_expire_after_ttl(plugin_module, plugin, monkeypatch):
+    plugin.init_plugin({"tmdb_api_key": "x"})
+    now = time.time()
+    monkeypatch.setattr(plugin_module.time, "time", lambda: now)
+    plugin._put_cached_tmdb_details('Show', None, 'tv', {'name': '剧集'})
+
+    monkeypatch.setattr(plugin_module.time, "time", lambda: now + plugin_module._TMDB_CACHE_TTL - 10)
+    assert plugin._get_cached_tmdb_details('Show', None, 'tv') == {'name': '剧集'}
+    monkeypatch.setattr(plugin_module.time, "time", lambda: now + plugin_module._TMDB_CACHE_TTL + 10)
+    assert plugin._get_cached_tmdb_details('Show', None, 'tv') is None
+
+
+def test_enrichment_caches_only_found_details_and_reuses_them(plugin, monkeypatch):
+    plugin.init_plugin({"tmdb_api_key": "x"})
+    _enrich_titles(plugin, monkeypatch, ['Found', 'Missing'],
+                   lambda title: {'name': title} if title == 'Found' else {})
+    keys = [row[0] for row in plugin._tmdb_cache.execute("SELECT key FROM tmdb")]
+    assert keys == ['tv|Found|']
+
+    fetched = []
+    _enrich_titles(plugin, monkeypatch, ['Found', 'Missing'], lambda title: fetched.append(title) or {})
+    assert fetched == ['Missing']
+    df = pd.read_parquet(plugin.enriched_tv_file).set_index('FilePath')
+    assert df.loc['Found', 'TMDb_Name'] == 'Found'
+
+
+class _CommitCounter:
+    def __init__(self, conn):
+        self._conn = conn
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+        self._conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def test_enrichment_commits_cache_in_batches(plugin, monkeypatch):
+    import sqlite3
+    from contextlib import closing
+
+    plugin.init_plugin({"tmdb_api_key": "x"})
+    plugin._tmdb_cache = counter = _CommitCounter(plugin._tmdb_cache)
+    _enrich_titles(plugin, monkeypatch, [f"Title {i}" for i in range(250)], lambda title: {'name': title})
+
+    # 每 100 条提交一次，结束时再提交剩余部分
+    assert counter.commits == 3
+    with closing(sqlite3.connect(plugin.tmdb_cache_file)) as other:
+        assert other.execute("SELECT COUNT(*) FROM tmdb").fetchone()[0] == 250
+
+
+def test_deletion_logs_one_summary_and_writes_history(plugin, tmp_path, caplog):
+    import glob
+
+    plugin.init_plugin({"tmdb_api_key": "x"})
+    targets = [tmp_path / f"movie{i}.mkv" for i in range(7)]
+    for target in targets:
+        target.write_bytes(b"\0")
+    missing = tmp_path / "gone.mkv"
+    with open(plugin.delete_list_file, 'w', encoding='utf-8') as f:
+        f.write("\n".join(str(p) for p in targets + [missing]) + "\n")
+
+    with caplog.at_level(logging.INFO, logger="medialibmanager-test"):
+        assert plugin._execute_deletion() == "操作完成！共成功删除 7 个文件。"
+
+    messages = [r.getMessage() for r in caplog.records]
+    summaries = [m for m in messages if m.startswith("[已删除 7 个文件]")]
+    assert len(summaries) == 1
+    assert not any(m.startswith("[已删除] ") for m in messages)
+    assert any(m.startswith("[跳过]") and str(missing) in m for m in messages)
+
+    (history_file,) = glob.glob(os.path.join(plugin.data_path, "deletion_history_*.log"))
+    assert history_file in summaries[0]
+    with open(history_file, encoding='utf-8') as f:
+        assert sorted(f.read().splitlines()) == sorted(str(p) for p in targets)
+    assert not os.path.exists(plugin.delete_list_file)
+
+    # 同一天的再次删除追加到同一个历史文件
+    extra = tmp_path / "extra.mkv"
+    extra.write_bytes(b"\0")
+    with open(plugin.delete_list_file, 'w', encoding='utf-8') as f:
+        f.write(f"{extra}\n")
+    plugin._execute_deletion()
+    with open(history_file, encoding='utf-8') as f:
+        assert f.read().splitlines()[-1] == str(extra)